@@ -6,13 +6,17 @@
 """
 from __future__ import print_function
 from pathlib import Path
+import hashlib
 import yaml
 from six.moves.urllib.parse import urldefrag, urljoin
 from six.moves.urllib.request import urlopen
 import logging
-from collections import defaultdict
+import sys
+from collections import defaultdict, OrderedDict
 from os.path import join, basename, normpath, abspath
 
+__version__ = "0.0.7rc2"
+
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger()
 
@@ -38,6 +42,25 @@ def finddict(_dict, keys):
     return p
 
 
+def count_nodes(node, memo=None):
+    """Count the nodes of a yaml object as if its aliases
+       were expanded, visiting each shared subtree once.
+
+       Recursive objects have an infinite size.
+    """
+    if not isinstance(node, (dict, list)):
+        return 1
+    memo = {} if memo is None else memo
+    if id(node) in memo:
+        return memo[id(node)][1]
+
+    memo[id(node)] = (node, float("inf"))
+    values = node.values() if isinstance(node, dict) else node
+    n = 1 + sum(count_nodes(v, memo) for v in values)
+    memo[id(node)] = (node, n)
+    return n
+
+
 def should_use_block(value):
     for c in u"\u000a\u000d\u001c\u001d\u001e\u0085\u2028\u2029":
         if c in value:
@@ -57,9 +80,29 @@ def my_represent_scalar(self, tag, value, style=None):
     return node
 
 
-def open_file_or_url(host):
+HTTP_VALIDATORS = ("etag", "last-modified")
+
+
+def content_hash(content):
+    if not isinstance(content, bytes):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+def open_file_or_url(host, validators=None):
+    """Return the content of a file or an url.
+
+       :param validators: if a dict is passed, it is updated
+            with the HTTP validators (eg. ETag) of the response.
+    """
     if host.startswith("http"):
-        return urlopen(host).read()
+        response = urlopen(host)
+        if validators is not None:
+            headers = response.info()
+            validators.update(
+                (k, headers[k]) for k in HTTP_VALIDATORS if headers.get(k)
+            )
+        return response.read()
     host = normpath(abspath(host))
     with open(host) as fh:
         return fh.read()
@@ -81,22 +124,140 @@ def fragment_to_keys(fragment):
     return fragment.strip("#").strip("/").split("/")
 
 
+class ReferenceCache(object):
+    """A LRU cache for the content of referenced documents.
+
+       Each entry is accounted with its approximate size in bytes.
+       When the total exceeds `max_size`, the least recently
+       used entries are evicted: they will be loaded again
+       on the next access.
+
+       :param loader: a function returning the content of a document.
+       :param max_size: the memory budget in bytes, None for no limit.
+    """
+
+    def __init__(self, loader, max_size=None):
+        self.loader = loader
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        if key in self.entries:
+            self.hits += 1
+            # Mark the entry as the most recently used.
+            content = self.entries.pop(key)
+            self.entries[key] = content
+            return content
+
+        self.misses += 1
+        content = self.loader(key)
+        self.entries[key] = content
+        self.size += sys.getsizeof(content)
+        self.evict()
+        return content
+
+    def evict(self):
+        while self.max_size is not None and self.size > self.max_size:
+            key, content = self.entries.popitem(last=False)
+            self.size -= sys.getsizeof(content)
+            self.evictions += 1
+            log.debug("evicted %r from the reference cache", key)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "size": self.size,
+        }
+
+
+def escape_pointer_token(key):
+    """Escape a key as a JSON pointer token (RFC6901)."""
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
 class OpenapiResolver(object):
     """Resolves an OpenAPI v3 spec file replacing
        yaml-references and json-$ref from
        the web.
     """
 
-    def __init__(self, openapi, context=None):
+    def __init__(self, openapi, context=None, cache_max_size=None, max_nodes=None):
+        """
+        :param openapi: the spec to resolve.
+        :param context: the path or url of the spec,
+            used to resolve relative references.
+        :param cache_max_size: the memory budget in bytes of the
+            reference cache, None for no limit.
+        :param max_nodes: the maximum number of nodes of the
+            spec once yaml aliases are expanded, None for no limit.
+        """
+        # deepcopy() preserves yaml aliases, as shared objects.
         self.openapi = deepcopy(openapi)
         # Global variables used by the parser.
         self.context = context
         self.is_subschema = False
-        self.yaml_cache = {}
+        self.yaml_cache = ReferenceCache(self.fetch, cache_max_size)
         self.yaml_components = defaultdict(dict)
+        # The documents read while resolving, with
+        #  their fingerprints.
+        self.input_closure = {}
+        # Shared (aliased) nodes are traversed once: track
+        #  them and the resolved $ref nodes by identity.
+        self.visited = {}
+        self.resolved = {}
+        self.max_nodes = max_nodes
+        # Library snapshots serving references, by prefix.
+        self.mounts = []
+
+    def mount(self, prefix, snapshot):
+        """Serve the references under `prefix` from a library snapshot.
+
+        :param prefix: an url or a path prefix, eg. "https://example.org/lib/".
+        :param snapshot: a snapshot.LibrarySnapshot.
+        """
+        if not prefix:
+            raise ValueError("Missing mount prefix.")
+        if not prefix.startswith("http"):
+            prefix = join(normpath(abspath(prefix)), "")
+        self.mounts.append((prefix, snapshot))
+
+    def check_expanded_nodes(self, node):
+        """Fail fast when `node` has more than max_nodes
+           once yaml aliases are expanded.
+        """
+        if self.max_nodes is None:
+            return
+        n = count_nodes(node)
+        if n > self.max_nodes:
+            raise ValueError(
+                "Too many nodes once yaml aliases are expanded: %r > %r"
+                % (n, self.max_nodes)
+            )
 
     def resolve(self):
+        # The memos are valid for a single traversal,
+        #  as the spec may change between calls.
+        self.visited = {}
+        self.resolved = {}
+        self.check_expanded_nodes(self.bundle())
         self.traverse(self.openapi, cb=self.resolve_node)
+
+        # Check the size of the bundle, as resolved
+        #  references may be aliased many times.
+        self.check_expanded_nodes(self.bundle())
         return self.openapi
 
     def check_traverse_and_set_context(self, key, node):
@@ -191,6 +352,13 @@ class OpenapiResolver(object):
         # Unwind items as a dict or an enumerated list
         # to simplify traversal.
         if isinstance(node, (dict, list)):
+            # Aliased nodes are already traversed, except $ref nodes:
+            #  their resolution depends on where they are.
+            is_ref = isinstance(node, dict) and "$ref" in node
+            if id(node) in self.visited and not is_ref:
+                return
+            self.visited[id(node)] = node
+
             valuelist = node.items() if isinstance(node, dict) else enumerate(node)
             if key is not ROOT_NODE:
                 parents.append(key)
@@ -213,11 +381,21 @@ class OpenapiResolver(object):
         if do_traverse:
             ancestor, needle = parents[-3:-1]
             # log.info(f"replacing: {needle} in {ancestor} with ref {node}. Parents are {parents}")
-            ancestor[needle] = cb(key, node, context)
+            ref_node = ancestor[needle]
 
             # Get the component where to store the given item.
             component_name = self.get_component_name(needle, parents)
 
+            # Reuse the result of an alias of this $ref node
+            #  resolved in the same component.
+            memo_key = (id(ref_node), component_name)
+            if memo_key in self.resolved:
+                ancestor[needle] = self.resolved[memo_key][1]
+                return
+
+            ancestor[needle] = cb(key, node, context)
+            self.check_expanded_nodes(ancestor[needle])
+
             # Use a pre and post traversal functions.
             # - before: append the reference to yaml_components.
             # - traverse
@@ -239,28 +417,70 @@ class OpenapiResolver(object):
                 log.debug("setting new anchor: %r", new_anchor)
 
                 # Now the node is fully resolved. I can replace it with the
-                # Deepcopy...
-                self.yaml_components[component_name][fragment] = deepcopy(
-                    ancestor[needle]
-                )
-
-                # ... and update the reference in the original part.
+                # reference in the original part.
                 if needle == "$ref":
+                    # The resolved item stays in the spec: deepcopy it.
+                    self.yaml_components[component_name][fragment] = deepcopy(
+                        ancestor[needle]
+                    )
                     parents[-1][needle] = new_anchor
                 else:
+                    # The resolved item is only referenced by yaml_components,
+                    #  so there's no need to copy it.
+                    self.yaml_components[component_name][fragment] = ancestor[needle]
                     ancestor[needle] = {"$ref": new_anchor}
 
+            # Memoize the result for the aliases of the $ref node.
+            if needle != "$ref":
+                self.resolved[memo_key] = (ref_node, ancestor[needle])
+
     def get_yaml_reference(self, f):
         # log.info(f"Downloading {f}")
         host, fragment = urldefrag(f)
-        if host not in self.yaml_cache:
-            self.yaml_cache[host] = open_file_or_url(host)
+        try:
+            return self.get_mounted_reference(host, fragment)
+        except KeyError:
+            pass
 
-        f_yaml = yaml.safe_load(self.yaml_cache[host])
+        f_yaml = yaml.safe_load(self.yaml_cache.get(host))
         if fragment.strip("/"):
             f_yaml = finddict(f_yaml, fragment_to_keys(fragment))
         return f_yaml
 
+    def get_mounted_reference(self, host, fragment):
+        """Get a reference from the mounted snapshots.
+
+           :raises KeyError: if no snapshot serves the reference.
+        """
+        if not host.startswith("http"):
+            host = normpath(abspath(host))
+        for prefix, snapshot in self.mounts:
+            if not host.startswith(prefix):
+                continue
+            rel = host[len(prefix):]
+            try:
+                f_yaml = snapshot.get(rel, fragment)
+            except KeyError:
+                continue
+            self.input_closure[host] = {"sha256": snapshot.documents[rel]["sha256"]}
+            return f_yaml
+        raise KeyError(host)
+
+    def fetch(self, host):
+        """Read a file or an url, recording it in the input closure.
+
+           Remote documents are fingerprinted with their validators,
+           when available, otherwise with their content hash.
+        """
+        fingerprint = {}
+        content = open_file_or_url(host, fingerprint)
+        if not fingerprint:
+            fingerprint["sha256"] = content_hash(content)
+        if not host.startswith("http"):
+            host = normpath(abspath(host))
+        self.input_closure[host] = fingerprint
+        return content
+
     def resolve_node(self, key, node, context):
         """This is the callback.
         """
@@ -277,6 +497,26 @@ class OpenapiResolver(object):
         _yaml = self.get_yaml_reference(n)
         return _yaml
 
+    def bundle(self, remove_tags=("x-commons",)):
+        """Return the spec with the resolved components,
+           without copying the nodes.
+        """
+        if not isinstance(self.openapi, dict):
+            return self.openapi
+
+        # Eventually remove some tags, eg. containing references and aliases.
+        openapi = {k: v for k, v in self.openapi.items() if k not in remove_tags}
+
+        # Add resolved schemas.
+        # XXX: check if the schema hash is the same in case
+        #      of multiple entries.
+        components = dict(openapi.get("components", {}))
+        for k, items in self.yaml_components.items():
+            components[k] = dict(components.get(k, {}))
+            components[k].update(items)
+        openapi["components"] = components
+        return openapi
+
     def dump(self, remove_tags=("x-commons",)):
         """Dump the OpenAPI spec removing yaml anchors.
 
@@ -287,7 +527,7 @@ class OpenapiResolver(object):
         # Dump long lines as "|".
         yaml.representer.SafeRepresenter.represent_scalar = my_represent_scalar
 
-        openapi = deepcopy(self.openapi)
+        openapi = deepcopy(self.bundle(remove_tags))
 
         # If it's not a dict, just dump the standard yaml
         if not isinstance(openapi, dict):
@@ -298,21 +538,6 @@ class OpenapiResolver(object):
                 Dumper=NoAnchorDumper,
             )
 
-        # Eventually remove some tags, eg. containing references and aliases.
-        for tag in remove_tags:
-            if tag in openapi:
-                del openapi[tag]
-
-        # Add resolved schemas.
-        # XXX: check if the schema hash is the same in case
-        #      of multiple entries.
-        components = openapi.setdefault("components", {})
-        for k, items in self.yaml_components.items():
-            if k not in components:
-                components[k] = {}
-
-            components[k].update(items)
-
         # Order yaml keys for a nice
         # dumping.
         yaml_keys = set(openapi.keys())
@@ -1,33 +1,120 @@
-from sys import argv
+from sys import argv, exit
+import json
 import yaml
 from . import OpenapiResolver
+from .bundle_cache import BundleCache
+from .diff import diff
+from .snapshot import LibrarySnapshot, compile_library
 import argparse
 
 
 
-def main(src_file, dst_file):
-
-    with open(src_file) as fh_src, open(dst_file, 'w') as fh_dst:
+def resolve_file(src_file, max_nodes=None, mounts=()):
+    with open(src_file) as fh_src:
         ret = yaml.safe_load(fh_src)
 
-        # Resolve nodes.
-        # TODO: this behavior could be customized eg.
-        #  to strip some kind of nodes.
-        resolver = OpenapiResolver(ret)
-        resolver.resolve()
+    # Resolve nodes.
+    # TODO: this behavior could be customized eg.
+    #  to strip some kind of nodes.
+    # Relative references are resolved against src_file.
+    resolver = OpenapiResolver(ret, src_file, max_nodes=max_nodes)
+    for prefix, snapshot_file in mounts:
+        resolver.mount(prefix, LibrarySnapshot(snapshot_file))
+    resolver.resolve()
+    return resolver
+
 
+def main(src_file, dst_file, cache_dir=None, max_nodes=None, mounts=()):
+    # Options affecting the bundle, used in the cache key.
+    options = {'remove_tags': ['x-commons'], 'max_nodes': max_nodes}
+
+    cache = BundleCache(cache_dir) if cache_dir else None
+    manifest = cache.lookup(src_file, options) if cache else None
+    if manifest:
+        content = cache.load(manifest)
+    else:
+        resolver = resolve_file(src_file, max_nodes, mounts)
         # Serialize file.
-        fh_dst.write(resolver.dump())
+        content = resolver.dump(remove_tags=options['remove_tags'])
+        if cache:
+            cache.store(src_file, options, resolver.input_closure, content)
+
+    with open(dst_file, 'w') as fh_dst:
+        fh_dst.write(content)
+
+
+def main_diff(src_file_a, src_file_b, dst_file, max_nodes=None):
+    # Compare the normalized bundles, like the ones
+    #  produced by main().
+    bundle_a = resolve_file(src_file_a, max_nodes).dump_yaml()
+    bundle_b = resolve_file(src_file_b, max_nodes).dump_yaml()
+
+    changes = diff(bundle_a, bundle_b)
+    with open(dst_file, 'w') as fh_dst:
+        fh_dst.write(json.dumps(changes, indent=2) + "\n")
+    return changes
+
+
+def main_compile_lib(lib_dir, dst_file):
+    n = compile_library(lib_dir, dst_file)
+    print("Compiled %d documents from %s into %s" % (n, lib_dir, dst_file))
 
 
 if __name__ == '__main__':
 
+    if argv[1:2] == ['diff']:
+        parser = argparse.ArgumentParser(
+            prog='openapi_resolver diff',
+            description='Resolves two OpenAPI v3 files and reports the changed JSON pointers.')
+        parser.add_argument('src_file_a', type=str,
+                            help='The original OpenAPI v3 yaml file.')
+        parser.add_argument('src_file_b', type=str,
+                            help='The modified OpenAPI v3 yaml file.')
+        parser.add_argument('dst_file', type=str, default='/dev/stdout', nargs='?',
+                            help='Destination file, default is stdout.')
+        parser.add_argument('--max-nodes', type=int, default=None,
+                            help='Fail when a spec has more nodes'
+                                 ' once yaml aliases are expanded.')
+        args = parser.parse_args(argv[2:])
+
+        main_diff(args.src_file_a, args.src_file_b, args.dst_file, args.max_nodes)
+        exit(0)
+
+    if argv[1:2] == ['compile-lib']:
+        parser = argparse.ArgumentParser(
+            prog='openapi_resolver compile-lib',
+            description='Compiles a directory of yaml definitions into a snapshot.')
+        parser.add_argument('lib_dir', type=str,
+                            help='The directory containing the yaml files.')
+        parser.add_argument('dst_file', type=str,
+                            help='The snapshot file.')
+        args = parser.parse_args(argv[2:])
+
+        main_compile_lib(args.lib_dir, args.dst_file)
+        exit(0)
+
     parser = argparse.ArgumentParser(description='Recursively resolves and bundles OpenAPI v3 files.')
-    parser.add_argument('src_file', type=str, 
+    parser.add_argument('src_file', type=str,
                         help='An OpenAPI v3 yaml file.')
     parser.add_argument('dst_file', type=str, default='/dev/stdout', nargs='?',
                         help='Destination file, default is stdout.')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='Reuse the bundles stored in this directory'
+                             ' when none of their input files changed.')
+    parser.add_argument('--max-nodes', type=int, default=None,
+                        help='Fail when the spec has more nodes'
+                             ' once yaml aliases are expanded.')
+    parser.add_argument('--mount', type=str, action='append', default=[],
+                        metavar='PREFIX=SNAPSHOT',
+                        help='Serve the references under the PREFIX url or path'
+                             ' from a snapshot created with compile-lib.')
     args = parser.parse_args()
 
-    main(args.src_file, args.dst_file)
+    mounts = []
+    for mount in args.mount:
+        prefix, _, snapshot_file = mount.rpartition('=')
+        if not prefix or not snapshot_file:
+            parser.error('--mount expects PREFIX=SNAPSHOT, got %r' % mount)
+        mounts.append((prefix, snapshot_file))
 
+    main(args.src_file, args.dst_file, args.cache_dir, args.max_nodes, mounts)
@@ -0,0 +1,154 @@
+"""A content-addressed cache of resolved bundles.
+
+    Every bundle is stored together with a manifest
+    listing the documents read to produce it (the input closure).
+    The cache key is the hash of the source file, of the
+    input closure, of the resolver options and version: when
+    none of them changed, the bundle can be reused
+    without resolving the spec again.
+
+    Layout of the cache directory:
+
+        manifests/<hash of the source path>.json
+        bundles/<key>.yaml
+"""
+from __future__ import print_function
+import json
+import logging
+import time
+from os import makedirs, remove, replace
+from os.path import abspath, dirname, exists, join, normpath
+from tempfile import NamedTemporaryFile
+from six.moves.urllib.request import Request, urlopen
+
+from . import HTTP_VALIDATORS, __version__, content_hash
+
+log = logging.getLogger()
+
+
+def head_validators(url):
+    request = Request(url)
+    request.get_method = lambda: "HEAD"
+    headers = urlopen(request).info()
+    return {k: headers[k] for k in HTTP_VALIDATORS if headers.get(k)}
+
+
+def current_fingerprint(uri, recorded):
+    """Fingerprint `uri` in the same way `recorded` was computed."""
+    if uri.startswith("http"):
+        if "sha256" not in recorded:
+            return head_validators(uri)
+        return {"sha256": content_hash(urlopen(uri).read())}
+
+    with open(uri) as fh:
+        return {"sha256": content_hash(fh.read())}
+
+
+def cache_key(options, inputs):
+    # Bundles produced by other versions of the resolver never match.
+    return content_hash(
+        json.dumps(
+            {"version": __version__, "options": options, "inputs": inputs},
+            sort_keys=True,
+        )
+    )
+
+
+def atomic_write(path, write):
+    """Write a file via a temporary file, so that
+       concurrent readers never see a partial content.
+
+       :param write: a function writing to a file handle.
+    """
+    with NamedTemporaryFile("w", dir=dirname(path), delete=False) as fh:
+        try:
+            write(fh)
+        except Exception:
+            fh.close()
+            remove(fh.name)
+            raise
+    replace(fh.name, path)
+
+
+class BundleCache(object):
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def manifest_path(self, src_file):
+        name = content_hash(normpath(abspath(src_file))) + ".json"
+        return join(self.cache_dir, "manifests", name)
+
+    def bundle_path(self, key):
+        return join(self.cache_dir, self.bundle_name(key))
+
+    @staticmethod
+    def bundle_name(key):
+        return join("bundles", key + ".yaml")
+
+    def lookup(self, src_file, options):
+        """Return the manifest of a cached bundle
+           if all its inputs are unchanged, else None.
+        """
+        manifest_path = self.manifest_path(src_file)
+        if not exists(manifest_path):
+            return None
+        try:
+            with open(manifest_path) as fh:
+                manifest = json.load(fh)
+            recorded_inputs = manifest["inputs"].items()
+        except (IOError, OSError, ValueError, KeyError, AttributeError) as e:
+            log.info("can't read cache manifest %r: %r", manifest_path, e)
+            return None
+
+        try:
+            inputs = {
+                uri: current_fingerprint(uri, recorded)
+                for uri, recorded in recorded_inputs
+            }
+        except (IOError, OSError) as e:
+            # Includes URLError.
+            log.info("can't validate cached bundle %r: %r", src_file, e)
+            return None
+
+        key = cache_key(options, inputs)
+        if key != manifest.get("key") or not exists(self.bundle_path(key)):
+            return None
+        return manifest
+
+    def load(self, manifest):
+        with open(self.bundle_path(manifest["key"])) as fh:
+            return fh.read()
+
+    def store(self, src_file, options, input_closure, content):
+        """Store the bundle `content` and its manifest.
+
+           :param input_closure: the documents read by the resolver,
+                see OpenapiResolver.input_closure.
+        """
+        src_file = normpath(abspath(src_file))
+        with open(src_file) as fh:
+            inputs = {src_file: {"sha256": content_hash(fh.read())}}
+        inputs.update(input_closure)
+
+        key = cache_key(options, inputs)
+        manifest = {
+            "src_file": src_file,
+            "key": key,
+            # Relative to cache_dir.
+            "bundle": self.bundle_name(key),
+            "created": time.time(),
+            "options": options,
+            "inputs": inputs,
+        }
+        for d in ("manifests", "bundles"):
+            if not exists(join(self.cache_dir, d)):
+                makedirs(join(self.cache_dir, d))
+
+        # Write the bundle first, so that a manifest
+        #  always references an existing bundle.
+        atomic_write(self.bundle_path(key), lambda fh: fh.write(content))
+        atomic_write(
+            self.manifest_path(src_file),
+            lambda fh: json.dump(manifest, fh, indent=2, sort_keys=True),
+        )
+        return manifest
@@ -0,0 +1,107 @@
+"""Structural diff of normalized OpenAPI bundles.
+
+    Every subtree is labelled with a Merkle hash, so that
+    two bundles are compared descending only into the
+    subtrees whose hashes differ. Changes are reported
+    as JSON pointers.
+"""
+from __future__ import print_function
+import hashlib
+
+from . import escape_pointer_token
+
+
+def _digest(*parts):
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class MerkleNode(object):
+    """A node of the hash tree built on top of a yaml object.
+
+       :param digest: the hash of the whole subtree.
+       :param children: a dict (or a list) of MerkleNode
+            for containers, None for scalars.
+    """
+
+    __slots__ = ("digest", "children")
+
+    def __init__(self, digest, children=None):
+        self.digest = digest
+        self.children = children
+
+
+def merkle_tree(node):
+    """Build the hash tree of a yaml object.
+
+       Dict hashes do not depend on the key ordering,
+       so reordered specs share the same hashes.
+    """
+    if isinstance(node, dict):
+        children = {k: merkle_tree(v) for k, v in node.items()}
+        entries = sorted(
+            _digest(repr(k), child.digest) for k, child in children.items()
+        )
+        return MerkleNode(_digest("dict", *entries), children)
+
+    if isinstance(node, list):
+        children = [merkle_tree(v) for v in node]
+        return MerkleNode(
+            _digest("list", *(child.digest for child in children)), children
+        )
+
+    return MerkleNode(_digest(type(node).__name__, repr(node)))
+
+
+def diff_trees(a, b, pointer="", changes=None):
+    """Compare two hash trees, returning a dict with the
+       JSON pointers of the "added", "removed" and "changed" entries.
+
+       Subtrees with the same hash are skipped.
+    """
+    if changes is None:
+        changes = {"added": [], "removed": [], "changed": []}
+
+    if a.digest == b.digest:
+        return changes
+
+    if isinstance(a.children, dict) and isinstance(b.children, dict):
+        keys_a, keys_b = list(a.children), list(b.children)
+    elif isinstance(a.children, list) and isinstance(b.children, list):
+        keys_a, keys_b = range(len(a.children)), range(len(b.children))
+    else:
+        # Type or scalar value changed. The root pointer is "".
+        changes["changed"].append(pointer)
+        return changes
+
+    # Compare keys by their pointer token, so that
+    #  eg. 200 and "200" are the same entry.
+    tokens_a = {escape_pointer_token(k): k for k in keys_a}
+    tokens_b = {escape_pointer_token(k): k for k in keys_b}
+    for token, k in tokens_a.items():
+        child_pointer = pointer + "/" + token
+        if token not in tokens_b:
+            changes["removed"].append(child_pointer)
+        elif k != tokens_b[token]:
+            # The key type changed.
+            changes["changed"].append(child_pointer)
+        else:
+            diff_trees(a.children[k], b.children[k], child_pointer, changes)
+    for token in tokens_b:
+        if token not in tokens_a:
+            changes["added"].append(pointer + "/" + token)
+
+    return changes
+
+
+def diff(a, b):
+    """Structurally compare two yaml objects, eg. two resolved bundles.
+
+       :return: a dict with the sorted JSON pointers of
+            "added", "removed" and "changed" entries.
+    """
+    changes = diff_trees(merkle_tree(a), merkle_tree(b))
+    return {k: sorted(v) for k, v in changes.items()}
@@ -0,0 +1,133 @@
+"""Precompiled snapshots of a library of yaml definitions.
+
+    A snapshot holds the parsed trees of all the yaml files
+    in a directory, plus an index of their nodes by JSON pointer,
+    so that the resolver can serve references without parsing yaml.
+
+    Snapshots are gzip-compressed pickle files, loaded with
+    an Unpickler restricted to the types produced by yaml.safe_load.
+"""
+from __future__ import print_function
+import copy
+import gzip
+import pickle
+import time
+from os.path import abspath, exists, getmtime, join, normpath
+from pathlib import Path
+
+import yaml
+
+from . import content_hash, escape_pointer_token, finddict, fragment_to_keys
+
+SNAPSHOT_VERSION = 2
+
+# Besides builtin containers and scalars, yaml.safe_load
+#  returns dates and sets.
+SAFE_CLASSES = {
+    ("builtins", "set"),
+    ("builtins", "frozenset"),
+    ("datetime", "date"),
+    ("datetime", "datetime"),
+    ("datetime", "timedelta"),
+    ("datetime", "timezone"),
+}
+
+
+class SafeUnpickler(pickle.Unpickler):
+    """An Unpickler that only loads data, without running code."""
+
+    def find_class(self, module, name):
+        if (module, name) not in SAFE_CLASSES:
+            raise pickle.UnpicklingError(
+                "Forbidden class in snapshot: %s.%s" % (module, name)
+            )
+        return pickle.Unpickler.find_class(self, module, name)
+
+
+def json_pointer(keys):
+    return "".join("/" + escape_pointer_token(k) for k in keys)
+
+
+def index_pointers(node, pointer, index):
+    """Index the containers in `node` by their JSON pointer.
+
+       Aliased nodes are indexed once, under their first pointer.
+    """
+    if not isinstance(node, (dict, list)) or id(node) in index["ids"]:
+        return
+    index["ids"].add(id(node))
+    index["pointers"][pointer] = node
+    items = node.items() if isinstance(node, dict) else enumerate(node)
+    for k, v in items:
+        index_pointers(v, pointer + "/" + escape_pointer_token(k), index)
+
+
+def compile_library(lib_dir, dst_file):
+    """Parse the yaml files in `lib_dir` and save them in a snapshot.
+
+       :return: the number of compiled documents.
+    """
+    lib_dir = Path(lib_dir)
+    documents = {}
+    index = {"ids": set(), "pointers": {}}
+    paths = sorted(list(lib_dir.rglob("*.yaml")) + list(lib_dir.rglob("*.yml")))
+    for path in paths:
+        rel = path.relative_to(lib_dir).as_posix()
+        mtime = getmtime(str(path))
+        with open(str(path)) as fh:
+            content = fh.read()
+        documents[rel] = {
+            "mtime": mtime,
+            "sha256": content_hash(content),
+            "tree": yaml.safe_load(content),
+        }
+        index_pointers(documents[rel]["tree"], rel + "#", index)
+
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "root": normpath(abspath(str(lib_dir))),
+        "created": time.time(),
+        "documents": documents,
+        "index": index["pointers"],
+    }
+    with gzip.open(dst_file, "wb") as fh:
+        pickle.dump(snapshot, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    return len(documents)
+
+
+class LibrarySnapshot(object):
+    def __init__(self, snapshot_file):
+        with gzip.open(snapshot_file, "rb") as fh:
+            snapshot = SafeUnpickler(fh).load()
+        version = snapshot.get("version") if isinstance(snapshot, dict) else None
+        if version != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported snapshot version: %r" % snapshot_file)
+        self.root = snapshot["root"]
+        self.documents = snapshot["documents"]
+        self.index = snapshot["index"]
+
+    def is_stale(self, rel):
+        """A document is stale when its source file is newer than the snapshot."""
+        if rel not in self.documents:
+            raise KeyError(rel)
+        src = join(self.root, rel)
+        return exists(src) and getmtime(src) > self.documents[rel]["mtime"]
+
+    def get(self, rel, fragment):
+        """Return a copy of the node referenced by `rel#fragment`.
+
+           :raises KeyError: if the node is not in the snapshot
+                or the document is stale.
+        """
+        if self.is_stale(rel):
+            raise KeyError(rel)
+
+        keys = fragment_to_keys(fragment) if fragment.strip("/") else []
+        # Index keys are escaped, so that each node
+        #  has the same keys used by finddict().
+        try:
+            node = self.index[rel + "#" + json_pointer(keys)]
+        except KeyError:
+            node = finddict(self.documents[rel]["tree"], keys)
+        # The resolver modifies the returned nodes.
+        return copy.deepcopy(node)
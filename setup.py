@@ -1,3 +1,4 @@
+import re
 import setuptools
 
 with open("README.md", "r") as fh:
@@ -6,9 +7,12 @@ with open("README.md", "r") as fh:
 with open('requirements.txt') as f:
     requirements = f.read().splitlines()
 
+with open('openapi_resolver/__init__.py') as f:
+    version = re.search(r'^__version__ = "(.*)"', f.read(), re.M).group(1)
+
 setuptools.setup(
     name="openapi_resolver",
-    version="0.0.7rc2",
+    version=version,
     author="Roberto Polli",
     author_email="robipolli@gmail.com",
     description="Resolve and bundle openapi v3 specs.",
@@ -1,11 +1,20 @@
+import gzip
 import logging
+import pickle
+import shutil
+import sys
+import time
 from collections import defaultdict
-from os import environ
+from os import environ, utime
 from pathlib import Path
 
 import pytest
 import yaml
-from openapi_resolver import OpenapiResolver
+from openapi_resolver import OpenapiResolver, ReferenceCache, count_nodes
+from openapi_resolver.__main__ import main_diff
+from openapi_resolver.bundle_cache import BundleCache
+from openapi_resolver.diff import diff
+from openapi_resolver.snapshot import LibrarySnapshot, compile_library
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger()
@@ -28,6 +37,15 @@ def yaml_dump(dict_):
     return yaml.dump(dict(dict_), default_flow_style=0)
 
 
+def billion_laughs():
+    """A yaml expanding to 9^9 strings via nested aliases."""
+    levels = ["a: &a [lol, lol, lol, lol, lol, lol, lol, lol, lol]"]
+    for prev, cur in zip("abcdefgh", "bcdefghi"):
+        aliases = ", ".join(["*" + prev] * 9)
+        levels.append("%s: &%s [%s]" % (cur, cur, aliases))
+    return "\n".join(levels)
+
+
 @pytest.mark.skip
 def test_resolve_file():
     oat = yaml.safe_load(Path("tests/data/simple.yaml").read_text())
@@ -354,3 +372,296 @@ def test_dump_noanchor():
     resolver.resolve()
     log.debug(resolver.dump())
     assert "*id" not in resolver.dump()
+
+
+def test_diff():
+    a = {
+        "openapi": "3.0.1",
+        "paths": {"/a": {"get": {"tags": ["x"]}}, "/b": {}},
+        "components": {"schemas": {"Person": {"type": "object"}}},
+    }
+    # Reorder keys and change a few entries.
+    b = {
+        "components": {"schemas": {"Person": {"type": "string"}, "Foo": {}}},
+        "paths": {"/c~/d": {}, "/a": {"get": {"tags": ["x"]}}},
+        "openapi": "3.0.1",
+    }
+    assert diff(a, a) == {"added": [], "removed": [], "changed": []}
+    assert diff(a, b) == {
+        "added": ["/components/schemas/Foo", "/paths/~1c~0~1d"],
+        "removed": ["/paths/~1b"],
+        "changed": ["/components/schemas/Person/type"],
+    }
+
+
+def test_diff_list():
+    assert diff({"a": [1, 2]}, {"a": [1, 3, 4]}) == {
+        "added": ["/a/2"],
+        "removed": [],
+        "changed": ["/a/1"],
+    }
+    assert diff({"a": [1]}, {"a": {"0": 1}})["changed"] == ["/a"]
+
+
+def test_diff_pointers():
+    # The root pointer is the empty string.
+    assert diff(1, 2)["changed"] == [""]
+    assert diff({}, [])["changed"] == [""]
+    # Quoted and unquoted response codes are the same entry.
+    assert diff({"r": {200: {}}}, {"r": {"200": {}}}) == {
+        "added": [],
+        "removed": [],
+        "changed": ["/r/200"],
+    }
+
+
+def test_input_closure():
+    fpath = Path("data/responses/responses.yaml")
+    oat = yaml_load_file(str(fpath))
+    resolver = OpenapiResolver(oat, str(fpath))
+    resolver.resolve()
+    inputs = {Path(k).name for k in resolver.input_closure}
+    assert {"headers.yaml", "problem.yaml"} <= inputs
+    for fingerprint in resolver.input_closure.values():
+        assert fingerprint["sha256"]
+
+
+def test_bundle_cache(tmpdir, monkeypatch):
+    data = Path(str(tmpdir.join("data")))
+    shutil.copytree("data", str(data))
+    fpath = data / "responses" / "responses.yaml"
+    options = {"remove_tags": ["x-commons"]}
+    cache = BundleCache(str(tmpdir.join("cache")))
+    assert cache.lookup(str(fpath), options) is None
+
+    resolver = OpenapiResolver(yaml_load_file(str(fpath)), str(fpath))
+    resolver.resolve()
+    content = resolver.dump()
+    manifest = cache.store(str(fpath), options, resolver.input_closure, content)
+    assert str(fpath) in manifest["inputs"]
+    assert manifest["bundle"] == "bundles/%s.yaml" % manifest["key"]
+
+    assert cache.lookup(str(fpath), options) == manifest
+    assert cache.load(manifest) == content
+    assert cache.lookup(str(fpath), {"remove_tags": []}) is None
+
+    # Bundles from another resolver version don't match.
+    monkeypatch.setattr("openapi_resolver.bundle_cache.__version__", "0.0.0")
+    assert cache.lookup(str(fpath), options) is None
+    monkeypatch.undo()
+
+    # A truncated manifest is a cache miss.
+    manifest_path = cache.manifest_path(str(fpath))
+    with open(manifest_path) as fh:
+        manifest_text = fh.read()
+    with open(manifest_path, "w") as fh:
+        fh.write(manifest_text[:10])
+    assert cache.lookup(str(fpath), options) is None
+    with open(manifest_path, "w") as fh:
+        fh.write(manifest_text)
+    assert cache.lookup(str(fpath), options) == manifest
+
+    # Changing a transitive input invalidates the bundle.
+    problem = data / "schemas" / "problem.yaml"
+    problem.write_text(problem.read_text() + "\n# changed\n")
+    assert cache.lookup(str(fpath), options) is None
+
+
+def test_reference_cache():
+    loaded = []
+
+    def loader(key):
+        loaded.append(key)
+        return key * 100
+
+    cache = ReferenceCache(loader, max_size=sys.getsizeof("a" * 100) * 3)
+    for key in ("a", "b", "a", "c", "d", "b"):
+        assert cache.get(key) == key * 100
+    assert loaded == ["a", "b", "c", "d", "b"]
+    assert "a" not in cache
+    assert cache.size <= cache.max_size
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 5
+    assert stats["evictions"] == 2
+
+
+def test_resolve_with_cache_budget():
+    fpath = Path("data/responses/responses.yaml")
+    oat = yaml_load_file(str(fpath))
+    resolver = OpenapiResolver(oat, str(fpath), cache_max_size=1)
+    resolver.resolve()
+    yaml_ = resolver.dump_yaml()
+    assert yaml_["components"]["schemas"]["Problem"]
+    assert len(resolver.yaml_cache) == 0
+    assert resolver.yaml_cache.stats()["evictions"] > 0
+
+
+def test_resolve_aliases():
+    oat = yaml.safe_load(
+        """
+x-commons:
+  ref: &ref
+    $ref: "data/headers/subheaders.yaml#/headers/Retry-After"
+components:
+  headers:
+    Retry-After: *ref
+    X-Retry-After: *ref
+"""
+    )
+    resolver = OpenapiResolver(oat, None)
+    resolver.resolve()
+    # The aliased $ref is fetched once and shared.
+    assert resolver.yaml_cache.stats()["misses"] == 1
+    headers = resolver.openapi["components"]["headers"]
+    assert headers["Retry-After"] is headers["X-Retry-After"]
+    assert headers["Retry-After"] == {"$ref": "#/components/headers/Retry-After"}
+    assert "*id" not in resolver.dump()
+
+
+def test_resolve_aliases_contexts():
+    # The same alias is hoisted according to where it is used.
+    oat = yaml.safe_load(
+        """
+x-commons:
+  r: &r
+    $ref: "data/schemas/problem.yaml#/Problem"
+paths:
+  /a:
+    get:
+      responses:
+        "200":
+          content:
+            application/json:
+              schema: *r
+components:
+  schemas:
+    P2: *r
+  headers:
+    H: *r
+"""
+    )
+    resolver = OpenapiResolver(oat, None)
+    resolver.resolve()
+    yaml_ = resolver.dump_yaml()
+    components = yaml_["components"]
+    path_schema = yaml_["paths"]["/a"]["get"]["responses"]["200"]["content"][
+        "application/json"
+    ]["schema"]
+    assert path_schema == {"$ref": "#/components/schemas/Problem"}
+    assert components["schemas"]["P2"] == {"$ref": "#/components/schemas/Problem"}
+    assert components["headers"]["H"] == {"$ref": "#/components/headers/Problem"}
+    assert components["schemas"]["Problem"]
+    assert components["headers"]["Problem"]
+
+
+def test_resolve_max_nodes():
+    # A bundle as big as max_nodes is accepted.
+    fpath = Path("data/responses/responses.yaml")
+    oat = yaml_load_file(str(fpath))
+    resolver = OpenapiResolver(oat, str(fpath))
+    resolver.resolve()
+    max_nodes = count_nodes(resolver.dump_yaml())
+
+    resolver = OpenapiResolver(oat, str(fpath), max_nodes=max_nodes)
+    resolver.resolve()
+    with pytest.raises(ValueError):
+        OpenapiResolver(oat, str(fpath), max_nodes=max_nodes - 1).resolve()
+
+
+def test_resolve_twice():
+    resolver = OpenapiResolver({"a": 1}, None)
+    resolver.resolve()
+    resolver.openapi["components"] = {
+        "headers": {
+            "X-Foo": {"$ref": "data/headers/subheaders.yaml#/headers/Retry-After"}
+        }
+    }
+    resolver.resolve()
+    assert "Retry-After" in resolver.yaml_components["headers"]
+    assert resolver.openapi["components"]["headers"]["X-Foo"] == {
+        "$ref": "#/components/headers/Retry-After"
+    }
+
+
+def test_diff_max_nodes(tmpdir):
+    laughs = tmpdir.join("laughs.yaml")
+    laughs.write(billion_laughs())
+    with pytest.raises(ValueError):
+        main_diff(str(laughs), str(laughs), str(tmpdir.join("out")), max_nodes=10000)
+
+
+def test_resolve_billion_laughs():
+    oat = yaml.safe_load(billion_laughs())
+
+    resolver = OpenapiResolver(oat, None)
+    assert resolver.resolve()
+    with pytest.raises(ValueError):
+        OpenapiResolver(oat, None, max_nodes=10000).resolve()
+
+
+def test_library_snapshot(tmpdir):
+    snapshot_file = str(tmpdir.join("lib.snapshot"))
+    assert compile_library("data", snapshot_file) > 0
+    snapshot = LibrarySnapshot(snapshot_file)
+    assert snapshot.get("headers/subheaders.yaml", "/headers/Retry-After")["schema"]
+    with pytest.raises(KeyError):
+        snapshot.get("missing.yaml", "")
+
+    fpath = Path("data/responses/responses.yaml")
+    oat = yaml_load_file(str(fpath))
+    expected = OpenapiResolver(oat, str(fpath))
+    expected.resolve()
+
+    resolver = OpenapiResolver(oat, str(fpath))
+    resolver.mount("data", snapshot)
+    resolver.resolve()
+    assert resolver.yaml_cache.stats()["misses"] == 0
+    assert resolver.dump_yaml() == expected.dump_yaml()
+
+
+def test_library_snapshot_stale(tmpdir):
+    data = Path(str(tmpdir.join("data")))
+    shutil.copytree("data", str(data))
+    snapshot_file = str(tmpdir.join("lib.snapshot"))
+    compile_library(str(data), snapshot_file)
+
+    # Update a source file after the snapshot.
+    problem = data / "schemas" / "problem.yaml"
+    problem.write_text(problem.read_text().replace("Problem", "NewProblem"))
+    mtime = time.time() + 10
+    utime(str(problem), (mtime, mtime))
+    snapshot = LibrarySnapshot(snapshot_file)
+    with pytest.raises(KeyError):
+        snapshot.get("schemas/problem.yaml", "")
+
+    resolver = OpenapiResolver({}, None)
+    resolver.mount(str(data), snapshot)
+    assert "NewProblem" in resolver.get_yaml_reference(str(problem))
+
+
+def test_library_snapshot_escaped_keys(tmpdir):
+    lib = tmpdir.mkdir("lib")
+    lib.join("defs.yaml").write(
+        yaml.safe_dump(
+            {"X": {"a": {"b": {"kind": "nested"}}, "a/b": {"kind": "slashkey"}}}
+        )
+    )
+    snapshot_file = str(tmpdir.join("lib.snapshot"))
+    compile_library(str(lib), snapshot_file)
+    snapshot = LibrarySnapshot(snapshot_file)
+    assert "defs.yaml#/X/a~1b" in snapshot.index
+
+    # The snapshot serves the same nodes as the source.
+    resolver = OpenapiResolver({}, None)
+    source = resolver.get_yaml_reference(str(lib.join("defs.yaml")) + "#/X/a/b")
+    assert source == {"kind": "nested"}
+    assert snapshot.get("defs.yaml", "/X/a/b") == source
+
+
+def test_library_snapshot_unsafe(tmpdir):
+    snapshot_file = str(tmpdir.join("evil.snapshot"))
+    with gzip.open(snapshot_file, "wb") as fh:
+        pickle.dump({"version": 2, "root": Path(".")}, fh)
+    with pytest.raises(pickle.UnpicklingError):
+        LibrarySnapshot(snapshot_file)